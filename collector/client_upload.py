@@ -74,8 +74,8 @@ def worker(source_url: str, source_id: str,
         contains e.g. Red Hat Identity base64 string and account_id
 
     """
-    thread = current_thread()
-    LOGGER.debug('%s: Worker started', thread.name)
+    thread_name = current_thread().name
+    LOGGER.debug('%s: Worker started', thread_name)
 
     b64_identity = acct_info['b64_identity']
     account_id = acct_info['account_id']
@@ -87,7 +87,7 @@ def worker(source_url: str, source_id: str,
     except utils.RetryFailedError as exception:
         LOGGER.error(
             '%s: Unable to fetch source data for "%s": %s',
-            thread.name, source_id, exception
+            thread_name, source_id, exception
         )
         prometheus_metrics.METRICS['get_errors'].inc()
         return
@@ -115,8 +115,8 @@ def worker(source_url: str, source_id: str,
     except utils.RetryFailedError as exception:
         LOGGER.error(
             '%s: Failed to pass data for "%s": %s',
-            thread.name, source_id, exception
+            thread_name, source_id, exception
         )
         prometheus_metrics.METRICS['post_errors'].inc()
 
-    LOGGER.debug('%s: Done, exiting', thread.name)
+    LOGGER.debug('%s: Done, exiting', thread_name)
@@ -10,7 +10,11 @@ SOURCES_HOST = os.environ.get('SOURCES_HOST')
 SOURCES_PATH = os.environ.get('SOURCES_PATH')
 INPUT_DATA_FORMAT = os.environ.get('INPUT_DATA_FORMAT', '').upper()
 APP_NAME = os.environ.get('APP_NAME')
+CONFIG_CACHE_DIR = os.environ.get('CONFIG_CACHE_DIR')
+COLUMNAR_DATA = os.environ.get('COLUMNAR_DATA', '').lower() in ['true', 'y']
 SSL_VERIFY = os.environ.get('SSL_VERIFY', 'true').lower() in ['true', 'y']
 REDIS_ENV = os.environ.get('REDIS_ENV', '{"host": "redis"}')
 REDIS_PASSWORD = os.environ.get('REDIS_PASSWORD', 'smartvm')
 PROCESS_WINDOW = int(os.environ.get('PROCESS_WINDOW', 60*60*24))
+MAX_WORKER_THREADS = int(os.environ.get('MAX_WORKER_THREADS', 10))
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('MAX_CONCURRENT_REQUESTS', 8))
@@ -2,6 +2,7 @@ import logging
 import math
 from threading import current_thread
 from objsize import get_deep_size
+import orjson
 
 import prometheus_metrics
 from . import utils
@@ -34,7 +35,7 @@ def _retrieve_hosts(headers: dict) -> dict:
     prometheus_metrics.METRICS['gets'].inc()
     resp = utils.retryable('get', url.format(1), headers=headers)
     prometheus_metrics.METRICS['get_successes'].inc()
-    resp = resp.json()
+    resp = orjson.loads(resp.content)
     total = resp['total']
     # Iterate next pages if any
     pages = math.ceil(total / resp['per_page'])
@@ -43,16 +44,17 @@ def _retrieve_hosts(headers: dict) -> dict:
     prometheus_metrics.METRICS['gets'].inc()
     resp = utils.retryable('get', url_profile.format(ids), headers=headers)
     prometheus_metrics.METRICS['get_successes'].inc()
-    results = resp.json()['results']
+    results = orjson.loads(resp.content)['results']
     for page in range(2, pages+1):
         prometheus_metrics.METRICS['gets'].inc()
         resp = utils.retryable('get', url.format(page), headers=headers)
         prometheus_metrics.METRICS['get_successes'].inc()
-        ids = ','.join([x['id'] for x in resp.json()['results']])
+        resp = orjson.loads(resp.content)
+        ids = ','.join([x['id'] for x in resp['results']])
         prometheus_metrics.METRICS['gets'].inc()
         resp = utils.retryable('get', url_profile.format(ids), headers=headers)
         prometheus_metrics.METRICS['get_successes'].inc()
-        results += resp.json()['results']
+        results += orjson.loads(resp.content)['results']
 
     return dict(results=results, total=total)
 
@@ -73,8 +75,8 @@ def worker(_: str, source_id: str, dest: str, acct_info: dict) -> None:
         contains e.g. Red Hat Identity base64 string and account_id
 
     """
-    thread = current_thread()
-    LOGGER.debug('%s: Worker started', thread.name)
+    thread_name = current_thread().name
+    LOGGER.debug('%s: Worker started', thread_name)
 
     b64_identity = acct_info['b64_identity']
     account_id = acct_info['account_id']
@@ -90,7 +92,7 @@ def worker(_: str, source_id: str, dest: str, acct_info: dict) -> None:
         prometheus_metrics.METRICS['get_errors'].inc()
         LOGGER.error(
             '%s: Unable to fetch source data for "%s": %s',
-            thread.name, source_id, exception
+            thread_name, source_id, exception
         )
         return
     LOGGER.debug(
@@ -113,8 +115,8 @@ def worker(_: str, source_id: str, dest: str, acct_info: dict) -> None:
     except utils.RetryFailedError as exception:
         LOGGER.error(
             '%s: Failed to pass data for "%s": %s',
-            thread.name, source_id, exception
+            thread_name, source_id, exception
         )
         prometheus_metrics.METRICS['post_errors'].inc()
 
-    LOGGER.debug('%s: Done, exiting', thread.name)
+    LOGGER.debug('%s: Done, exiting', thread_name)
@@ -5,11 +5,17 @@ from threading import current_thread
 import sys
 import redis
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from gunicorn.arbiter import Arbiter
 
-from .env import SSL_VERIFY, REDIS_ENV, REDIS_PASSWORD, PROCESS_WINDOW
+from .env import (SSL_VERIFY, REDIS_ENV, REDIS_PASSWORD, PROCESS_WINDOW,
+                  MAX_WORKER_THREADS, MAX_CONCURRENT_REQUESTS)
 
 MAX_RETRIES = 3
+RETRY_BACKOFF_FACTOR = 0.3
+RETRY_STATUSES = (500, 502, 503, 504)
+RETRY_METHODS = frozenset(('GET', 'POST'))
 LOGGER = logging.getLogger()
 
 # pylama:ignore=E1101
@@ -22,6 +28,41 @@ if not (REDIS_ENV and REDIS_PASSWORD):
 REDIS = redis.Redis(**json.loads(REDIS_ENV), password=REDIS_PASSWORD)
 
 
+def _create_retry() -> Retry:
+    """Create retry policy with exponential backoff.
+
+    MAX_RETRIES is the number of attempts in total, including the first one.
+    """
+    retry_kwargs = dict(
+        total=MAX_RETRIES - 1,
+        backoff_factor=RETRY_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+    )
+    try:
+        return Retry(allowed_methods=RETRY_METHODS, **retry_kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=RETRY_METHODS, **retry_kwargs)
+
+
+def _create_session() -> requests.Session:
+    """Create HTTP session with a connection pool shared by all workers."""
+    session = requests.Session()
+    session.verify = SSL_VERIFY
+    # Each worker runs up to MAX_CONCURRENT_REQUESTS requests at once
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=MAX_WORKER_THREADS * MAX_CONCURRENT_REQUESTS,
+        max_retries=_create_retry()
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+_SESSION = _create_session()
+
+
 def ping_redis() -> bool:
     """Call ping on Redis."""
     try:
@@ -55,30 +96,29 @@ class RetryFailedError(requests.HTTPError):
 def retryable(method: str, *args, **kwargs) -> requests.Response:
     """Retryable HTTP request.
 
-    Invoke a "method" on "requests.session" with retry logic.
+    Invoke a "method" on a shared "requests.Session" with retry logic.
+    Retries with exponential backoff are handled by the session adapter.
     :param method: "get", "post" etc.
     :param *args: Args for requests (first should be an URL, etc.)
     :param **kwargs: Kwargs for requests
     :return: Response object
     :raises: HTTPError when all requests fail
     """
-    thread = current_thread()
-    request_kwargs = dict(verify=SSL_VERIFY)
-    request_kwargs.update(kwargs)
-
-    with requests.Session() as session:
-        for attempt in range(MAX_RETRIES):
-            try:
-                resp = getattr(session, method)(*args, **request_kwargs)
-
-                resp.raise_for_status()
-            except (requests.HTTPError, requests.ConnectionError) as e:
-                LOGGER.warning(
-                    '%s: Request failed (attempt #%d), retrying: %s',
-                    thread.name, attempt, str(e)
-                )
-                continue
-            else:
-                return resp
-
-    raise RetryFailedError('All attempts failed')
+    # Session level "verify" is overridden by CA bundle environment variables
+    kwargs.setdefault('verify', SSL_VERIFY)
+    resp = None
+    try:
+        resp = _SESSION.request(method, *args, **kwargs)
+
+        resp.raise_for_status()
+    except (requests.HTTPError, requests.ConnectionError,
+            requests.exceptions.RetryError) as e:
+        # Streamed responses hold their pooled connection until closed
+        if resp is not None:
+            resp.close()
+        LOGGER.warning(
+            '%s: Request failed: %s', current_thread().name, str(e)
+        )
+        raise RetryFailedError('All attempts failed') from e
+
+    return resp
@@ -1,3 +1,5 @@
+import orjson
+
 import collector
 
 # R0201 = Method could be a function Used when a method doesn't use its bound
@@ -13,14 +15,14 @@ class TestRetrieveHosts:
     def test_get_single_pages(self, mocker):
         """When results are in one page."""
         page1 = mocker.MagicMock()
-        page1.json.return_value = dict(
+        page1.content = orjson.dumps(dict(
             page=1,
             total=3,
             per_page=5,
             results=[{'id': '0'}, {'id': '1'}, {'id': '2'}, {'id': '3'}],
-        )
+        ))
         profiles = mocker.MagicMock()
-        profiles.json.return_value = dict(results=[1, 2, 3])
+        profiles.content = orjson.dumps(dict(results=[1, 2, 3]))
         retryable = mocker.patch.object(
             collector.utils, 'retryable', side_effect=[page1, profiles]
         )
@@ -64,12 +66,12 @@ class TestRetrieveHosts:
         )
         page1 = mocker.MagicMock()
         page2 = mocker.MagicMock()
-        page1.json.return_value = responses[0]
-        page2.json.return_value = responses[1]
+        page1.content = orjson.dumps(responses[0])
+        page2.content = orjson.dumps(responses[1])
         profile1 = mocker.MagicMock()
         profile2 = mocker.MagicMock()
-        profile1.json.return_value = responses[2]
-        profile2.json.return_value = responses[3]
+        profile1.content = orjson.dumps(responses[2])
+        profile2.content = orjson.dumps(responses[3])
         retryable = mocker.patch.object(
             collector.utils, 'retryable', side_effect=[
                 page1, profile1, page2, profile2]
@@ -1,9 +1,16 @@
+from imp import reload
 import base64
+import io
 import json
+import os
+import orjson
 import yaml
 
 import pytest
+import requests
+import urllib3
 
+import collector
 from collector import topological_inventory, utils
 
 
@@ -18,6 +25,11 @@ from collector import topological_inventory, utils
 class TestLoadYaml:
     """Test suite for _load_yaml."""
 
+    @pytest.fixture(autouse=True)
+    def default_setup(self, monkeypatch):
+        """Cache next to the YAML file by default."""
+        monkeypatch.setattr(topological_inventory, 'CONFIG_CACHE_DIR', None)
+
     def test_valid_file(self, mocker):
         """Valid and existent filename is passed to the function."""
         data = "- A\n- List\n- Of\n- Things"
@@ -40,6 +52,98 @@ class TestLoadYaml:
         with pytest.raises(yaml.scanner.ScannerError):
             topological_inventory._load_yaml('some.yaml')
 
+    def test_cache_created(self, tmp_path):
+        """Parsed content should be cached as JSON next to the file."""
+        yaml_file = tmp_path / 'some.yaml'
+        yaml_file.write_text('a:\n  - b\n')
+
+        output = topological_inventory._load_yaml(str(yaml_file))
+
+        assert output == dict(a=['b'])
+        cache = tmp_path / 'some.yaml.cache.json'
+        assert json.loads(cache.read_text()) == dict(a=['b'])
+
+    def test_cache_dir(self, monkeypatch, tmp_path):
+        """Parsed content should be cached in CONFIG_CACHE_DIR if set."""
+        cache_dir = tmp_path / 'cache'
+        cache_dir.mkdir()
+        monkeypatch.setattr(
+            topological_inventory, 'CONFIG_CACHE_DIR', str(cache_dir)
+        )
+        yaml_file = tmp_path / 'some.yaml'
+        yaml_file.write_text('a:\n  - b\n')
+
+        topological_inventory._load_yaml(str(yaml_file))
+
+        cache = cache_dir / 'some.yaml.cache.json'
+        assert json.loads(cache.read_text()) == dict(a=['b'])
+        assert not (tmp_path / 'some.yaml.cache.json').exists()
+
+    @pytest.mark.parametrize('content', [
+        '1: a\n',
+        'true: a\n',
+        'a:\n  ~: b\n',
+    ])
+    def test_cache_lossy(self, tmp_path, content):
+        """Content changed by a JSON round trip should not be cached."""
+        yaml_file = tmp_path / 'some.yaml'
+        yaml_file.write_text(content)
+
+        first = topological_inventory._load_yaml(str(yaml_file))
+        second = topological_inventory._load_yaml(str(yaml_file))
+
+        assert first == second == yaml.safe_load(content)
+        assert not (tmp_path / 'some.yaml.cache.json').exists()
+
+    def test_cache_used(self, tmp_path):
+        """Fresh cache should be preferred over the YAML file."""
+        yaml_file = tmp_path / 'some.yaml'
+        yaml_file.write_text('a: b\n')
+        cache = tmp_path / 'some.yaml.cache.json'
+        cache.write_text('{"a": "cached"}')
+
+        output = topological_inventory._load_yaml(str(yaml_file))
+
+        assert output == dict(a='cached')
+
+    def test_stale_cache(self, tmp_path):
+        """Cache older than the YAML file should be ignored and refreshed."""
+        yaml_file = tmp_path / 'some.yaml'
+        yaml_file.write_text('a: b\n')
+        cache = tmp_path / 'some.yaml.cache.json'
+        cache.write_text('{"a": "cached"}')
+        mtime = yaml_file.stat().st_mtime
+        os.utime(str(cache), (mtime - 10, mtime - 10))
+
+        output = topological_inventory._load_yaml(str(yaml_file))
+
+        assert output == dict(a='b')
+        assert json.loads(cache.read_text()) == dict(a='b')
+
+
+class TestConfig:
+    """Test suite for module level configuration."""
+
+    def test_queries_for_app_only(self, monkeypatch):
+        """Only query specs for configured entities should be kept."""
+        monkeypatch.setenv('APP_NAME', 'aiops-volume-type-validation')
+        reload(collector.env)
+        reload(topological_inventory)
+
+        assert topological_inventory.APP_CONFIG
+        assert set(topological_inventory.QUERIES) == \
+            set(topological_inventory.APP_CONFIG)
+
+    def test_no_app(self, monkeypatch):
+        """No query specs should be kept if the app is not set."""
+        monkeypatch.delenv('APP_NAME', raising=False)
+        reload(collector.env)
+        reload(topological_inventory)
+
+        assert topological_inventory.APP_CONFIG is None
+        assert topological_inventory.QUERIES == {}
+        assert not any(topological_inventory.PLAN)
+
 
 class TestUpdateFk:
     """Test suite for _update_fk."""
@@ -73,15 +177,73 @@ class TestUpdateFk:
         assert data_t[0]['fk'] == 3
 
 
+def _page(mocker, content: dict):
+    """Mock a streamed response with given JSON content."""
+    page = mocker.Mock()
+    page.raw = io.BytesIO(json.dumps(content).encode())
+    return page
+
+
+class TestParsePage:
+    """Test suite for _parse_page."""
+
+    def test_rows_and_next_link(self):
+        """Should parse rows and link to the next page."""
+        stream = io.BytesIO(json.dumps({
+            'meta': {'count': 2},
+            'links': {'next': '/next_page'},
+            'data': [{'id': '1', 'tags': ['a']}, {'id': '2', 'x': {}}],
+        }).encode())
+
+        rows, next_link = topological_inventory._parse_page(stream)
+
+        assert rows == [{'id': '1', 'tags': ['a']}, {'id': '2', 'x': {}}]
+        assert next_link == '/next_page'
+
+    def test_last_page(self):
+        """Should return no link on the last page."""
+        stream = io.BytesIO(b'{"data": [0, 1], "links": {"next": null}}')
+
+        rows, next_link = topological_inventory._parse_page(stream)
+
+        assert rows == [0, 1]
+        assert next_link is None
+
+
+class TestToSoa:
+    """Test suite for _to_soa."""
+
+    def test_pivot(self):
+        """Uniform rows should be pivoted to columns."""
+        rows = [{'id': 1, 'name': 'a'}, {'name': 'b', 'id': 2}]
+
+        output = topological_inventory._to_soa(rows)
+
+        assert output == dict(
+            columns=['id', 'name'],
+            rows=[[1, 'a'], [2, 'b']]
+        )
+
+    @pytest.mark.parametrize('rows', [
+        [],
+        [0, 1],
+        [{'id': 1, 'name': 'a'}, {'id': 2}],
+        [{'id': 1}, {'id': 2, 'name': 'b'}],
+    ])
+    def test_fallback(self, rows):
+        """Empty or non uniform rows should be kept as they are."""
+        assert topological_inventory._to_soa(rows) is rows
+
+
 class TestCollectData:
     """Test suite for _collect_data."""
 
     def test_get_single_page(self, mocker):
         """Collect a single page data."""
         retryable = mocker.patch.object(utils, 'retryable')
-        page_0 = mocker.Mock()
-        page_0.json.return_value = dict(data=[0, 1, 2], links={})
-        retryable.return_value = page_0
+        retryable.return_value = _page(
+            mocker, dict(data=[0, 1, 2], links={})
+        )
 
         data = topological_inventory._collect_data(
             dict(host='host', path='path'), 'url'
@@ -89,21 +251,20 @@ class TestCollectData:
 
         assert data == [0, 1, 2]
         retryable.assert_called_once_with(
-            'get', 'host/path/url', headers=None
+            'get', 'host/path/url', headers=None, stream=True
         )
 
     def test_get_multiple_pages(self, mocker):
         """Collect paginated data."""
         retryable = mocker.patch.object(utils, 'retryable')
-        page_0, page_1 = mocker.Mock(), mocker.Mock()
-        page_0.json.return_value = {
+        page_0 = _page(mocker, {
             'data': [0, 1, 2],
             'links': dict(next='/next_page')
-        }
-        page_1.json.return_value = {
+        })
+        page_1 = _page(mocker, {
             'data': [3, 4, 5],
             'links': {}
-        }
+        })
         retryable.side_effect = [page_0, page_1]
 
         data = topological_inventory._collect_data(
@@ -114,12 +275,95 @@ class TestCollectData:
         assert data == [0, 1, 2, 3, 4, 5]
 
         retryable.assert_any_call(
-            'get', 'host/path/url', headers=None
+            'get', 'host/path/url', headers=None, stream=True
         )
         retryable.assert_any_call(
-            'get', 'host/next_page', headers=None
+            'get', 'host/next_page', headers=None, stream=True
+        )
+        page_0.close.assert_called_once()
+        page_1.close.assert_called_once()
+
+    @pytest.mark.parametrize('pages,calls', [
+        ([[9], [0]], 1),
+        ([[0], [9]], 2),
+    ])
+    def test_invalid_page(self, mocker, pages, calls):
+        """Walk should stop at the first page which fails validation."""
+        retryable = mocker.patch.object(utils, 'retryable')
+        retryable.side_effect = [
+            _page(mocker, dict(data=pages[0], links=dict(next='/next'))),
+            _page(mocker, dict(data=pages[1], links=dict(next='/next'))),
+        ]
+
+        data = topological_inventory._collect_data(
+            dict(host='host', path='path'), 'url',
+            validate_page=lambda rows: 9 not in rows
         )
 
+        assert data is None
+        assert retryable.call_count == calls
+
+    def test_metrics(self, mocker):
+        """Requests should be counted once per call, including failures."""
+        metrics = mocker.patch.dict(
+            topological_inventory.prometheus_metrics.METRICS,
+            gets=mocker.Mock(), get_successes=mocker.Mock()
+        )
+        retryable = mocker.patch.object(utils, 'retryable')
+        retryable.side_effect = [
+            _page(mocker, dict(data=[0], links=dict(next='/next_page'))),
+            utils.RetryFailedError(),
+        ]
+
+        with pytest.raises(utils.RetryFailedError):
+            topological_inventory._collect_data(
+                dict(host='host', path='path'), 'url'
+            )
+
+        metrics['gets'].inc.assert_called_once_with(2)
+        metrics['get_successes'].inc.assert_called_once_with(1)
+
+
+def _broken_page(mocker, kind: str):
+    """Mock a streamed response failing while the body is read."""
+    page = mocker.Mock()
+    if kind == 'truncated':
+        page.raw = io.BytesIO(b'{"data": [0, 1')
+    else:
+        page.raw = mocker.Mock()
+        page.raw.read.side_effect = urllib3.exceptions.ProtocolError()
+    return page
+
+
+class TestGetPage:
+    """Test suite for _get_page."""
+
+    @pytest.mark.parametrize('kind', ('truncated', 'protocol'))
+    def test_read_retried(self, mocker, kind):
+        """Broken body should be downloaded again."""
+        retryable = mocker.patch.object(utils, 'retryable')
+        broken = _broken_page(mocker, kind)
+        retryable.side_effect = [
+            broken, _page(mocker, dict(data=[0, 1], links={}))
+        ]
+
+        rows, _ = topological_inventory._get_page('url')
+
+        assert rows == [0, 1]
+        assert retryable.call_count == 2
+        broken.close.assert_called_once()
+
+    @pytest.mark.parametrize('kind', ('truncated', 'protocol'))
+    def test_read_failed(self, mocker, kind):
+        """Should raise RetryFailedError when all reads fail."""
+        retryable = mocker.patch.object(utils, 'retryable')
+        retryable.side_effect = lambda *_, **__: _broken_page(mocker, kind)
+
+        with pytest.raises(utils.RetryFailedError):
+            topological_inventory._get_page('url')
+
+        assert retryable.call_count == utils.MAX_RETRIES
+
 
 class TestQueryMainCollection:
     """Test suite for _query_main_collection."""
@@ -208,7 +452,8 @@ class TestQuerySubCollection:
         topological_inventory._query_sub_collection(entity, data)
 
         mock.assert_called_once_with(
-            expected_service, mocker.ANY, headers=mocker.ANY
+            expected_service, mocker.ANY, headers=mocker.ANY,
+            validate_page=mocker.ANY
         )
 
     def test_service_fallback(self, monkeypatch, mocker):
@@ -232,7 +477,8 @@ class TestQuerySubCollection:
         topological_inventory._query_sub_collection(entity, data)
 
         mock.assert_called_once_with(
-            dict(host='topological', path=''), mocker.ANY, headers=mocker.ANY
+            dict(host='topological', path=''), mocker.ANY, headers=mocker.ANY,
+            validate_page=mocker.ANY
         )
 
     def test_pass_headers(self, mocker):
@@ -249,11 +495,35 @@ class TestQuerySubCollection:
         topological_inventory._query_sub_collection(entity, data, headers)
 
         mock.assert_called_once_with(
-            mocker.ANY, mocker.ANY, headers={'header': 'value'}
+            mocker.ANY, mocker.ANY, headers={'header': 'value'},
+            validate_page=mocker.ANY
         )
 
-    def test_called_for_every_entry(self, mocker):
-        """A subcollection should be collected for every main entry."""
+    def test_executor(self, mocker):
+        """Records should be fetched on the given executor."""
+        entity = dict(
+            main_collection='x', sub_collection='y', foreign_key='fk_x'
+        )
+        data = dict(x=[{'id': 1}, {'id': 2}])
+        topological_inventory._UNBATCHABLE.add((None, 'y', 'fk_x'))
+
+        mock = mocker.patch.object(topological_inventory, '_collect_data')
+        mock.side_effect = lambda *_, **__: [{'id': 3}]
+        executor = mocker.Mock()
+        executor.map.side_effect = map
+
+        output = topological_inventory._query_sub_collection(
+            entity, data, executor=executor
+        )
+
+        executor.map.assert_called_once()
+        assert output == [{'id': 3, 'fk_x': 1}, {'id': 3, 'fk_x': 2}]
+
+    def test_batched(self, monkeypatch, mocker):
+        """Subcollection should be filtered by foreign key in batches."""
+        monkeypatch.setattr(
+            topological_inventory, 'SUB_COLLECTION_BATCH_SIZE', 2
+        )
         entity = dict(
             main_collection='x', sub_collection='y', foreign_key='fk_x'
         )
@@ -261,17 +531,154 @@ class TestQuerySubCollection:
 
         mock = mocker.patch.object(topological_inventory, '_collect_data')
         mock.side_effect = [
-            [{'id': i, 'name': f'sub_{i}'}] for i in range(4, 7)
+            [{'id': 4, 'fk_x': 1}, {'id': 5, 'fk_x': 2}],
+            [{'id': 6, 'fk_x': 3}],
         ]
 
         output = topological_inventory._query_sub_collection(entity, data)
 
-        assert mock.call_count == 3
-        print(output)
+        assert output == [
+            {'id': 4, 'fk_x': 1}, {'id': 5, 'fk_x': 2}, {'id': 6, 'fk_x': 3}
+        ]
+        mock.assert_has_calls([
+            mocker.call(mocker.ANY, 'y?filter[fk_x][in]=1,2',
+                        headers=mocker.ANY, validate_page=mocker.ANY),
+            mocker.call(mocker.ANY, 'y?filter[fk_x][in]=3',
+                        headers=mocker.ANY, validate_page=mocker.ANY),
+        ])
+
+    def test_batched_url_with_query(self, mocker):
+        """Filter should be appended to an existing query string."""
+        entity = dict(
+            main_collection='x', sub_collection='y?filter[a][nil]',
+            foreign_key='fk'
+        )
+        data = dict(x=[{'id': 1, 'name': 'stub_object_1'}])
+
+        mock = mocker.patch.object(topological_inventory, '_collect_data')
+
+        topological_inventory._query_sub_collection(entity, data)
+
+        mock.assert_called_once_with(
+            mocker.ANY, 'y?filter[a][nil]&filter[fk][in]=1',
+            headers=mocker.ANY, validate_page=mocker.ANY
+        )
+
+    def test_called_for_every_entry(self, mocker):
+        """A subcollection should be collected for every main entry."""
+        entity = dict(
+            main_collection='x', sub_collection='y', foreign_key='fk_x'
+        )
+        data = dict(x=[{'id': i, 'name': 'main_1'} for i in range(1, 4)])
+
+        def collect_data(_, url, headers, **__):
+            # Filter is rejected, items are fetched concurrently
+            if 'filter' in url:
+                raise utils.RetryFailedError()
+            sub_id = int(url[2]) + 3
+            return [{'id': sub_id, 'name': f'sub_{sub_id}'}]
+
+        mock = mocker.patch.object(topological_inventory, '_collect_data')
+        mock.side_effect = collect_data
+
+        output = topological_inventory._query_sub_collection(entity, data)
+
+        assert mock.call_count == 4
         assert output == [
             {'id': i, 'name': f'sub_{i}', 'fk_x': i-3} for i in range(4, 7)
         ]
 
+    def test_filter_ignored(self, mocker):
+        """Should query per record if the filter is ignored by the service."""
+        entity = dict(
+            main_collection='x', sub_collection='y', foreign_key='fk_x'
+        )
+        data = dict(x=[{'id': 1, 'name': 'main_1'}])
+
+        def collect_data(_, url, headers, validate_page=None):
+            if validate_page:
+                rows = [{'id': 2, 'fk_x': 1}, {'id': 3, 'fk_x': 7}]
+                return rows if validate_page(rows) else None
+            return [{'id': 2}]
+
+        mock = mocker.patch.object(topological_inventory, '_collect_data')
+        mock.side_effect = collect_data
+
+        output = topological_inventory._query_sub_collection(entity, data)
+
+        assert output == [{'id': 2, 'fk_x': 1}]
+        mock.assert_called_with(mocker.ANY, 'x/1/y', headers=mocker.ANY)
+
+    @pytest.mark.parametrize('status,remembered', [
+        (400, True),
+        (403, False),
+        (404, False),
+        (503, False),
+        (None, False),
+    ])
+    def test_unbatchable_remembered(self, mocker, status, remembered):
+        """Filter should not be retried once rejected by the service."""
+        entity = dict(
+            main_collection='x', sub_collection='y', foreign_key='fk_x'
+        )
+        data = dict(x=[{'id': 1, 'name': 'main_1'}])
+
+        error = utils.RetryFailedError()
+        if status:
+            error.__cause__ = requests.HTTPError(
+                response=mocker.Mock(status_code=status)
+            )
+        mock = mocker.patch.object(topological_inventory, '_collect_data')
+        mock.side_effect = [error, [], []]
+
+        topological_inventory._query_sub_collection(entity, data)
+        topological_inventory._query_sub_collection(entity, data)
+
+        assert mock.call_count == 3
+        if remembered:
+            mock.assert_called_with(mocker.ANY, 'x/1/y', headers=mocker.ANY)
+        else:
+            mock.assert_called_with(
+                mocker.ANY, 'y?filter[fk_x][in]=1', headers=mocker.ANY,
+                validate_page=mocker.ANY
+            )
+
+    def test_late_batch_failed(self, monkeypatch, mocker):
+        """Transient failure of a later batch should not mark unbatchable."""
+        monkeypatch.setattr(
+            topological_inventory, 'SUB_COLLECTION_BATCH_SIZE', 1
+        )
+        entity = dict(
+            main_collection='x', sub_collection='y', foreign_key='fk_x'
+        )
+        data = dict(x=[{'id': 1}, {'id': 2}])
+
+        mock = mocker.patch.object(topological_inventory, '_collect_data')
+        mock.side_effect = [
+            [{'id': 3, 'fk_x': 1}], utils.RetryFailedError(),
+            [{'id': 3}], [{'id': 4}],
+        ]
+
+        output = topological_inventory._query_sub_collection(entity, data)
+
+        assert output == [{'id': 3, 'fk_x': 1}, {'id': 4, 'fk_x': 2}]
+        assert not topological_inventory._UNBATCHABLE
+
+    def test_empty_main_collection(self, mocker):
+        """No request should be made when there are no records."""
+        entity = dict(
+            main_collection='x', sub_collection='y', foreign_key='fk_x'
+        )
+
+        data = dict(x=[])
+
+        mock = mocker.patch.object(topological_inventory, '_collect_data')
+
+        output = topological_inventory._query_sub_collection(entity, data)
+
+        assert output == []
+        mock.assert_not_called()
+
     @pytest.mark.parametrize('entity', [
         dict(sub_collection='y', foreign_key='fk'),
         dict(main_collection='x', foreign_key='fk'),
@@ -282,6 +689,21 @@ class TestQuerySubCollection:
         with pytest.raises(KeyError):
             topological_inventory._query_sub_collection(entity, {})
 
+    def test_failed_item(self, mocker):
+        """Should raise if any of the items fails to be collected."""
+        entity = dict(
+            main_collection='x', sub_collection='y', foreign_key='fk_x'
+        )
+        data = dict(x=[{'id': i, 'name': 'main_1'} for i in range(1, 4)])
+
+        mock = mocker.patch.object(topological_inventory, '_collect_data')
+        mock.side_effect = [
+            utils.RetryFailedError(), [], utils.RetryFailedError(), []
+        ]
+
+        with pytest.raises(utils.RetryFailedError):
+            topological_inventory._query_sub_collection(entity, data)
+
     def test_url_format(self, mocker):
         """Subcollection URL should be formed properly."""
         entity = dict(
@@ -293,9 +715,11 @@ class TestQuerySubCollection:
 
         mock = mocker.patch.object(topological_inventory, '_collect_data')
 
+        mock.side_effect = [utils.RetryFailedError(), []]
+
         topological_inventory._query_sub_collection(entity, data)
 
-        mock.assert_called_once_with(mocker.ANY, 'x/1/y', headers=mocker.ANY)
+        mock.assert_called_with(mocker.ANY, 'x/1/y', headers=mocker.ANY)
 
 
 class TestWorker:
@@ -346,9 +770,10 @@ class TestWorker:
 
         topological_inventory.worker('', 'source_id', 'dest', account)
 
+        # Header is built by create_tenant from the account number
         mock_collector.assert_called_once_with(
             '', 'source_id', 'dest',
-            {'x-rh-identity': account['b64_identity']}, mocker.ANY
+            {'x-rh-identity': account['b64_identity'].decode()}
         )
         mock_redis.assert_called_once_with(1)
 
@@ -358,7 +783,7 @@ class TestTopologicalInventoryData:
 
     @pytest.fixture(autouse=True)
     def default_setup(self, mocker, monkeypatch):
-        """Set mocker and QUERIES before every test run."""
+        """Set mocker and queries before every test run."""
         # pylama: ignore=W0201
         self.query_main = mocker.patch.object(
             topological_inventory, '_query_main_collection'
@@ -367,50 +792,51 @@ class TestTopologicalInventoryData:
             topological_inventory, '_query_sub_collection'
         )
         self.retryable = mocker.patch.object(utils, 'retryable')
-        self.thread = mocker.Mock(name='thread')
 
-        monkeypatch.setattr(
-            topological_inventory, 'QUERIES', {
-                'a': {
-                    'main_collection': 'a'
-                },
-                'b': {
-                    'main_collection': 'b'
-                },
-                'sub_of_a': {
-                    'sub_collection': 'sub',
-                    'main_collection': 'a',
-                    'foreign_key': 'a_id'
-                }
+        self.queries = {
+            'a': {
+                'main_collection': 'a'
+            },
+            'b': {
+                'main_collection': 'b'
+            },
+            'sub_of_a': {
+                'sub_collection': 'sub',
+                'main_collection': 'a',
+                'foreign_key': 'a_id'
             }
+        }
+        self.monkeypatch = monkeypatch
+
+    def set_app_config(self, app_config):
+        """Set PLAN for given entities."""
+        self.monkeypatch.setattr(
+            topological_inventory, 'PLAN',
+            topological_inventory._build_plan(app_config, self.queries)
         )
 
-    def test_no_collections(self, monkeypatch):
+    def test_no_collections(self):
         """Should not call next service if no queries are specified."""
-        monkeypatch.setattr(topological_inventory, 'APP_CONFIG', [])
+        self.set_app_config([])
 
         topological_inventory.topological_inventory_data(
-            None, 'stub_id', 'dest', {}, self.thread
+            None, 'stub_id', 'dest', {}
         )
 
         self.retryable.assert_not_called()
 
-    def test_invalid_collection(self, monkeypatch):
-        """Should raise if collection is not present in QUERIES."""
-        monkeypatch.setattr(topological_inventory, 'APP_CONFIG', ['c'])
-
+    def test_invalid_collection(self):
+        """Should raise if collection is not present in queries."""
         with pytest.raises(KeyError):
-            topological_inventory.topological_inventory_data(
-                None, 'stub_id', 'dest', {}, self.thread
-            )
+            self.set_app_config(['c'])
 
-    def test_main_collections(self, monkeypatch):
+    def test_main_collections(self):
         """Collect a main collection only."""
-        monkeypatch.setattr(topological_inventory, 'APP_CONFIG', ['a'])
+        self.set_app_config(['a'])
         self.query_main.return_value = [0, 1]
 
         topological_inventory.topological_inventory_data(
-            None, 'stub_id', 'dest', {}, self.thread
+            None, 'stub_id', 'dest', {}
         )
 
         self.query_main.assert_called_once_with(
@@ -418,20 +844,21 @@ class TestTopologicalInventoryData:
         )
         self.query_sub.assert_not_called()
         self.retryable.assert_called_once_with(
-            'post', 'dest', headers={},
-            json={
+            'post', 'dest',
+            headers={'Content-Type': 'application/json'},
+            data=orjson.dumps({
                 'id': 'stub_id',
                 'data': dict(a=[0, 1])
-            }
+            })
         )
 
-    def test_sub_collections(self, monkeypatch, mocker):
+    def test_sub_collections(self, mocker):
         """Collect a sub collection only."""
-        monkeypatch.setattr(topological_inventory, 'APP_CONFIG', ['sub_of_a'])
+        self.set_app_config(['sub_of_a'])
         self.query_sub.return_value = [0, 1]
 
         topological_inventory.topological_inventory_data(
-            None, 'stub_id', 'dest', {}, self.thread
+            None, 'stub_id', 'dest', {}
         )
 
         self.query_main.assert_not_called()
@@ -443,46 +870,127 @@ class TestTopologicalInventoryData:
             },
             # _query_sub_collection is called with mutable data['data']
             mocker.ANY,
-            headers={}
+            headers={},
+            executor=mocker.ANY
         )
         self.retryable.assert_called_once_with(
-            'post', 'dest', headers={},
-            json={
+            'post', 'dest',
+            headers={'Content-Type': 'application/json'},
+            data=orjson.dumps({
                 'id': 'stub_id',
                 'data': dict(sub_of_a=[0, 1])
-            }
+            })
         )
 
     @pytest.mark.parametrize('main,sub,calls', [
-        ([[], ['b_item']], [['sub_of_a_item']], [1, 0]),
-        ([['a_item'], []], [['sub_of_a_item']], [2, 0]),
-        ([['a_item'], ['b_item']], [[]], [2, 1]),
+        # Collection "b" is cancelled unless already started
+        ([[], ['b_item']], [['sub_of_a_item']], [(1, 2), 0]),
+        ([['a_item'], []], [['sub_of_a_item']], [(2,), 0]),
+        ([['a_item'], ['b_item']], [[]], [(2,), 1]),
     ])
-    def test_no_data(self, monkeypatch, main, sub, calls):
+    def test_no_data(self, main, sub, calls):
         """Should return if any collection is empty."""
-        monkeypatch.setattr(
-            topological_inventory, 'APP_CONFIG',
-            ['a', 'b', 'sub_of_a']
-        )
+        self.set_app_config(['a', 'b', 'sub_of_a'])
 
         self.query_main.side_effect = main
         self.query_sub.side_effect = sub
 
         topological_inventory.topological_inventory_data(
-            None, 'stub_id', 'dest', {}, self.thread
+            None, 'stub_id', 'dest', {}
         )
-        assert self.query_main.call_count == calls[0]
+        assert self.query_main.call_count in calls[0]
         assert self.query_sub.call_count == calls[1]
         self.retryable.assert_not_called()
 
-    def test_failed_retry(self, monkeypatch):
+    def test_data_size(self, mocker):
+        """Should observe size of the passed payload."""
+        self.set_app_config(['a'])
+        self.query_main.return_value = [0, 1]
+        observe = mocker.patch.object(
+            topological_inventory.prometheus_metrics.METRICS['data_size'],
+            'observe'
+        )
+
+        topological_inventory.topological_inventory_data(
+            None, 'stub_id', 'dest', {}
+        )
+
+        observe.assert_called_once_with(
+            len(self.retryable.call_args[1]['data'])
+        )
+
+    def test_columnar_data(self, monkeypatch):
+        """Should pass columnar data if enabled."""
+        monkeypatch.setattr(topological_inventory, 'COLUMNAR_DATA', True)
+        self.set_app_config(['a'])
+        self.query_main.return_value = [{'id': 0}, {'id': 1}]
+
+        topological_inventory.topological_inventory_data(
+            None, 'stub_id', 'dest', {}
+        )
+
+        assert json.loads(self.retryable.call_args[1]['data']) == {
+            'id': 'stub_id',
+            'data': dict(a=dict(columns=['id'], rows=[[0], [1]]))
+        }
+
+    def test_float_values(self, mocker):
+        """Should serialize float values parsed from the pages."""
+        self.set_app_config(['a'])
+        self.query_main.side_effect = lambda spec, headers: (
+            topological_inventory._collect_data(
+                dict(host='host', path='path'), spec['main_collection'],
+                headers=headers
+            )
+        )
+        self.retryable.side_effect = lambda method, *_, **__: (
+            _page(mocker, dict(data=[{'id': 0, 'cpu': 0.5}], links={}))
+            if method == 'get' else mocker.Mock()
+        )
+
+        topological_inventory.topological_inventory_data(
+            None, 'stub_id', 'dest', {}
+        )
+
+        assert orjson.loads(self.retryable.call_args[1]['data']) == {
+            'id': 'stub_id',
+            'data': dict(a=[{'id': 0, 'cpu': 0.5}])
+        }
+
+    def test_main_before_sub(self):
+        """Sub collections should be queried after all main collections."""
+        self.set_app_config(['sub_of_a', 'a', 'b'])
+        self.query_main.side_effect = lambda spec, headers: [
+            spec['main_collection']
+        ]
+        self.query_sub.side_effect = lambda spec, data, headers, executor: [
+            dict(data)
+        ]
+
+        topological_inventory.topological_inventory_data(
+            None, 'stub_id', 'dest', {}
+        )
+
+        assert self.query_main.call_count == 2
+        self.retryable.assert_called_once_with(
+            'post', 'dest',
+            headers={'Content-Type': 'application/json'},
+            data=orjson.dumps({
+                'id': 'stub_id',
+                'data': dict(
+                    a=['a'], b=['b'], sub_of_a=[dict(a=['a'], b=['b'])]
+                )
+            })
+        )
+
+    def test_failed_retry(self):
         """Should not pass data if collection fails due to exception."""
-        monkeypatch.setattr(topological_inventory, 'APP_CONFIG', ['a'])
+        self.set_app_config(['a'])
 
         self.query_main.side_effect = utils.RetryFailedError()
 
         topological_inventory.topological_inventory_data(
-            None, 'stub_id', 'dest', {}, self.thread
+            None, 'stub_id', 'dest', {}
         )
 
         self.query_main.assert_called_once_with(
@@ -491,6 +999,25 @@ class TestTopologicalInventoryData:
         self.query_sub.assert_not_called()
         self.retryable.assert_not_called()
 
+    def test_failed_cancels_pending(self, mocker):
+        """Pending collections should be cancelled when one fails."""
+        self.set_app_config(['a', 'b'])
+        executor_cls = mocker.patch.object(
+            topological_inventory, 'ThreadPoolExecutor'
+        )
+        executor = executor_cls.return_value.__enter__.return_value
+        failed, pending = mocker.Mock(), mocker.Mock()
+        failed.result.side_effect = utils.RetryFailedError()
+        executor.submit.side_effect = [failed, pending]
+
+        topological_inventory.topological_inventory_data(
+            None, 'stub_id', 'dest', {}
+        )
+
+        pending.cancel.assert_called_once()
+        pending.result.assert_not_called()
+        self.retryable.assert_not_called()
+
 
 class TestTenant:
     """Test suite for create_tenant."""
@@ -511,11 +1038,22 @@ class TestTenant:
 
     def test_base64_identity_value(self):
         """Test if base64 encoded string matches for the value."""
-        b64 = b'eyJpZGVudGl0eSI6IHsiYWNjb3VudF9udW1iZXIiOiA0Mn19'
+        b64 = 'eyJpZGVudGl0eSI6IHsiYWNjb3VudF9udW1iZXIiOiA0Mn19'
         info = topological_inventory.create_tenant(42)
 
         assert b64 == info.headers['x-rh-identity']
 
+    def test_identity_cached(self, mocker):
+        """Identity should be encoded once per account."""
+        topological_inventory._identity_header.cache_clear()
+        b64encode = mocker.spy(topological_inventory.base64, 'b64encode')
+
+        first = topological_inventory.create_tenant('42')
+        second = topological_inventory.create_tenant('42')
+
+        assert first.headers == second.headers
+        b64encode.assert_called_once()
+
     def test_base64_identity_structure(self):
         """Test if base64 encoded string contains expected properties."""
         info = topological_inventory.create_tenant(42)
@@ -7,8 +7,9 @@ from collector import utils
 # R0201 = Method could be a function Used when a method doesn't use its bound
 # instance, and so could be written as a function.
 # R0903 = Too few public methods
+# W0212 = Access to a protected member _create_session of a client class
 
-# pylint: disable=R0201,R0903
+# pylint: disable=R0201,R0903,W0212
 
 
 def test_success_ping_redis(mocker):
@@ -45,61 +46,98 @@ class TestRetryable:
     def default_setup(self, mocker):
         """Set mock for session and response before every test run."""
         # pylama: ignore=W0201
-        session_cls = mocker.patch.object(requests, 'Session')
-        self.session = mocker.MagicMock()
-        self.session.__enter__.return_value = self.session
-        session_cls.return_value = self.session
+        self.session = mocker.patch.object(utils, '_SESSION')
 
         self.response = mocker.Mock()
         response_cls = mocker.patch.object(requests, 'Response')
         response_cls.return_value = self.response
-        self.session.get.return_value = self.response
-        self.session.post.return_value = self.response
+        self.session.request.return_value = self.response
 
-    def test_response(self, mocker):
+    def test_response(self):
         """Test a response can be received."""
         resp = utils.retryable('get', 'http://some.thing')
 
-        self.session.get.assert_called_once_with(
-            'http://some.thing', verify=mocker.ANY
+        self.session.request.assert_called_once_with(
+            'get', 'http://some.thing', verify=utils.SSL_VERIFY
         )
         assert resp == self.response
 
     @pytest.mark.parametrize('method', ('get', 'GET', 'post', 'POST'))
-    def test_method_selection(self, mocker, method):
+    def test_method_selection(self, method):
         """Test method selection propagation."""
         utils.retryable(method, 'http://some.thing')
 
-        getattr(self.session, method).assert_called_once_with(
-            'http://some.thing', verify=mocker.ANY
+        self.session.request.assert_called_once_with(
+            method, 'http://some.thing', verify=utils.SSL_VERIFY
         )
 
-    def test_retry(self):
-        """Should retry when first request fails."""
-        self.response.raise_for_status.side_effect = \
-            [requests.HTTPError(), None]
+    @pytest.mark.parametrize('ssl_verify', (True, False))
+    def test_ssl_verify(self, monkeypatch, ssl_verify):
+        """SSL_VERIFY should be passed with each request."""
+        monkeypatch.setattr(utils, 'SSL_VERIFY', ssl_verify)
+        monkeypatch.setenv('REQUESTS_CA_BUNDLE', '/stub/ca.pem')
 
         utils.retryable('get', 'http://some.thing')
 
-        assert self.session.get.call_count == 2
+        assert self.session.request.call_args[1]['verify'] == ssl_verify
+
+    @pytest.mark.parametrize('exception', (
+        requests.HTTPError(),
+        requests.ConnectionError(),
+        requests.exceptions.RetryError(),
+    ))
+    def test_retry_failed(self, exception):
+        """Should raise when the request fails after all retries."""
+        self.session.request.side_effect = exception
 
-    def test_retry_failed(self):
-        """Should retry as many as MAX_RETRIES."""
+        with pytest.raises(utils.RetryFailedError):
+            utils.retryable('get', 'http://some.thing')
+
+        assert self.session.request.call_count == 1
+
+    def test_failed_status(self):
+        """Should raise on an unsuccessful status code."""
         self.response.raise_for_status.side_effect = requests.HTTPError()
 
         with pytest.raises(utils.RetryFailedError):
             utils.retryable('get', 'http://some.thing')
 
-        assert self.session.get.call_count == utils.MAX_RETRIES
+    def test_failed_status_closed(self):
+        """Failed streamed response should release its connection."""
+        self.response.raise_for_status.side_effect = requests.HTTPError()
+
+        with pytest.raises(utils.RetryFailedError):
+            utils.retryable('get', 'http://some.thing', stream=True)
+
+        self.response.close.assert_called_once()
+
+    @pytest.mark.parametrize('scheme', ('http://', 'https://'))
+    def test_retry_policy(self, scheme):
+        """Session adapters should retry with backoff."""
+        session = utils._create_session()
+        retry = session.get_adapter(scheme).max_retries
+
+        # MAX_RETRIES attempts in total, including the first one
+        assert retry.total == utils.MAX_RETRIES - 1
         assert utils.MAX_RETRIES > 1
+        assert retry.backoff_factor > 0
+        assert set(retry.status_forcelist) == set(utils.RETRY_STATUSES)
+
+    def test_pool_size(self):
+        """Connection pool should fit all concurrent requests."""
+        session = utils._create_session()
+        adapter = session.get_adapter('https://')
+
+        assert adapter._pool_maxsize >= (
+            utils.MAX_WORKER_THREADS * utils.MAX_CONCURRENT_REQUESTS
+        )
+        assert not adapter._pool_block
 
     @pytest.mark.parametrize('ssl_verify', (True, False))
     def test_ssl_validate(self, monkeypatch, ssl_verify):
-        """Should respect SSL_VERIFY settings."""
+        """Session should respect SSL_VERIFY settings."""
         monkeypatch.setattr(utils, 'SSL_VERIFY', ssl_verify)
 
-        utils.retryable('get', 'http://some.thing')
+        session = utils._create_session()
 
-        self.session.get.assert_called_once_with(
-            'http://some.thing', verify=ssl_verify
-        )
+        assert session.verify == ssl_verify
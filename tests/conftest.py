@@ -1,9 +1,14 @@
 from imp import reload
 import os
+import tempfile
 
 import pytest
 
-import collector
+# Keep config caches out of the package, configs are loaded on first import
+_CACHE_DIR = tempfile.TemporaryDirectory()
+os.environ['CONFIG_CACHE_DIR'] = _CACHE_DIR.name
+
+import collector  # noqa: E402 pylint: disable=C0413
 
 
 @pytest.fixture(autouse=True)
@@ -0,0 +1,72 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import workers
+
+# R0201 = Method could be a function Used when a method doesn't use its bound
+# instance, and so could be written as a function.
+# W0212 = Access to a protected member _log_failure of a client class
+
+# pylint: disable=R0201,W0212
+
+
+class TestDownloadJob:
+    """Test suite for `download_job`."""
+
+    def test_submit(self, mocker):
+        """Job should be submitted to the executor."""
+        executor = mocker.patch.object(workers, 'EXECUTOR')
+        worker = mocker.patch.object(workers, 'WORKER')
+
+        workers.download_job('url', 'source_id', 'dest', 'identity')
+
+        executor.submit.assert_called_once_with(
+            worker, 'url', 'source_id', 'dest', 'identity'
+        )
+        executor.submit.return_value.add_done_callback.assert_called_once_with(
+            workers._log_failure
+        )
+
+    def test_missing_source_id(self, mocker):
+        """Job identifier should be generated if missing."""
+        executor = mocker.patch.object(workers, 'EXECUTOR')
+
+        workers.download_job('url', None, 'dest')
+
+        source_id = executor.submit.call_args[0][2]
+        assert source_id
+
+    def test_runs_worker(self, mocker):
+        """Worker should be run with job arguments."""
+        executor = ThreadPoolExecutor(max_workers=1)
+        mocker.patch.object(workers, 'EXECUTOR', executor)
+        worker = mocker.patch.object(workers, 'WORKER')
+
+        workers.download_job('url', 'source_id', 'dest', 'identity')
+        executor.shutdown(wait=True)
+
+        worker.assert_called_once_with('url', 'source_id', 'dest', 'identity')
+
+
+class TestLogFailure:
+    """Test suite for `_log_failure`."""
+
+    def test_failure_logged(self, mocker):
+        """Exception raised by a worker should be logged."""
+        logger = mocker.patch.object(workers, 'LOGGER')
+        future = Future()
+        future.set_exception(ValueError('boom'))
+
+        workers._log_failure(future)
+
+        logger.error.assert_called_once()
+        assert 'boom' in str(logger.error.call_args)
+
+    def test_success_not_logged(self, mocker):
+        """Successful worker should not be logged as failed."""
+        logger = mocker.patch.object(workers, 'LOGGER')
+        future = Future()
+        future.set_result(None)
+
+        workers._log_failure(future)
+
+        logger.error.assert_not_called()
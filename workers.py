@@ -1,12 +1,26 @@
 import logging
-from threading import Thread
+from concurrent.futures import Future, ThreadPoolExecutor
 from uuid import uuid4
 
 from collector import WORKER
+from collector.env import MAX_WORKER_THREADS
 
 LOGGER = logging.getLogger()
 
-LIVE_THREADS = []
+EXECUTOR = ThreadPoolExecutor(
+    max_workers=MAX_WORKER_THREADS,
+    thread_name_prefix='Worker'
+)
+
+
+def _log_failure(future: Future) -> None:
+    """Log exception raised by a finished worker, if any."""
+    exception = future.exception()
+    if exception:
+        LOGGER.error(
+            'Worker failed: %s', exception,
+            exc_info=(type(exception), exception, exception.__traceback__)
+        )
 
 
 def download_job(
@@ -29,15 +43,8 @@ def download_job(
     # When source_id is missing, create our own
     source_id = source_id or str(uuid4())
 
-    thread = Thread(
-        target=WORKER,
-        args=(source_url, source_id, dest_url, b64_identity)
-        )
-    LIVE_THREADS.append(thread)
-    thread.start()
-
-    # Cleanup
-    for thread in LIVE_THREADS:
-        if not thread.is_alive():
-            thread.join()
-            LIVE_THREADS.remove(thread)
+    # Jobs over the thread limit are queued until a worker is available
+    future = EXECUTOR.submit(
+        WORKER, source_url, source_id, dest_url, b64_identity
+    )
+    future.add_done_callback(_log_failure)